@@ -3,7 +3,7 @@
 # Autoconvolution for long audio files
 #
 # The autoconvolution can produce very interesting effects on audio (especially if the overall spectrum envelope is preserved)
-# For loading non-wav files (like mp3, ogg, etc) or changing the sample_rate it requires "avconv"
+# For loading the input files (wav, mp3, ogg, etc) and changing the sample_rate it requires "avconv" and "avprobe"
 # This software requires a lot of temporary hard drive space for processing 
 #
 # You can try this for a whole melody to get interesting effect.
@@ -23,14 +23,37 @@ import os.path
 import subprocess
 import tempfile
 import glob
-from collections import defaultdict
+import json
+import multiprocessing
 
 from scipy import signal,ndimage
+import scipy.fftpack
 import wave
 import scipy.io.wavfile #for debugging
 
 import numpy as np
 
+try:
+    from numba import njit,prange
+except ImportError:
+    njit=None
+
+try:
+    import numexpr as ne
+    ne.set_num_threads(multiprocessing.cpu_count())
+except ImportError:
+    ne=None
+
+try:
+    import pyfftw
+except ImportError:
+    pyfftw=None
+
+try:
+    import cupy as cp
+except ImportError:
+    cp=None
+
 from optparse import OptionParser
 from tempfile import TemporaryFile
 
@@ -44,41 +67,187 @@ def debug_write_wav(filename,sample_rate,smp):
 def cleanup_memory():
     gc.collect()
 
-def get_tmpfft_filename(tmpdir,block_k,nchannel):
-    return os.path.join(tmpdir,"tmpfft_%d_%d" % (block_k,nchannel)+tmpextension)
+#get the sample rate and the number of channels of the first audio stream
+def get_audio_info(input_filename):
+    try:
+        output=subprocess.check_output(["avprobe", "-v","quiet", "-of","json", "-show_streams",input_filename])
+    except (OSError,subprocess.CalledProcessError):
+        print "Error: Could not run avprobe on input file:",input_filename
+        sys.exit(1)
+    for stream in json.loads(output)["streams"]:
+        if stream.get("codec_type")=="audio":
+            #avprobe prints the sample rate as a float (e.g. "44100.000000")
+            return (int(float(stream["sample_rate"])),int(stream["channels"]))
+    print "Error: No audio stream found in input file:",input_filename
+    sys.exit(1)
 
 def get_tmpsmp_filename(tmpdir,block_k):
     return os.path.join(tmpdir,"tmpsmp_%d" % (block_k)+tmpextension)
 
 
+#convert a half precision FFT block from the temporary files to complex64, using the float32 array buf
+def dequantize_freqs(freqs,buf):
+    buf[:]=freqs
+    return buf.view(np.complex64)
+
+#FFTs of the last axis with fft_lib (numpy.fft, or pyfftw if selected), keeping single precision
+fft_lib=np.fft
+
+def rfft(smp):
+    return np.complex64(fft_lib.rfft(smp,axis=-1))
+
+def irfft(freqs,n):
+    return np.float32(fft_lib.irfft(freqs,n=n))
+
+#use the numpy interface of pyfftw for the FFTs (it takes the number of threads from the pyfftw config)
+def use_pyfftw(nthreads):
+    global fft_lib
+    #the same FFT size is used for all blocks, so the planning time with FFTW_MEASURE is spent only once
+    import pyfftw.interfaces.cache
+    import pyfftw.interfaces.numpy_fft
+    pyfftw.interfaces.cache.enable()
+    pyfftw.config.PLANNER_EFFORT="FFTW_MEASURE"
+    pyfftw.config.NUM_THREADS=nthreads
+    fft_lib=pyfftw.interfaces.numpy_fft
+
 def optimize_fft_size(n):
-    orig_n=n
-    while True:
-        n=orig_n
-        while (n%2)==0:
-            n/=2
-        while (n%3)==0:
-            n/=3
-        if n<2:
-            break
-        orig_n+=1
-    return orig_n
-
-def get_block_mixes(n_blocks):
-    pos=defaultdict(lambda:{})
-    
-    for j in range(n_blocks):
-        for i in range(n_blocks):
-            val=(min(i,j),max(i,j))
-            if val not in pos[i+j]:
-                pos[i+j][val]=0
-            pos[i+j][val]+=1
-    result=[v for k,v in pos.iteritems()]
+    return scipy.fftpack.next_fast_len(int(n))
+
+#for each output block s, the input block pairs (i,s-i) which are mixed into it and their multiplicity
+#if limit_blocks>0, only the pairs at most limit_blocks apart are used (s-2*i<=limit_blocks, so i starts at (s-limit_blocks+1)//2)
+def get_block_mixes(n_blocks,limit_blocks=0):
+    result=[]
+    for s in range(2*n_blocks-1):
+        first=max(0,s-n_blocks+1)
+        if limit_blocks>0:
+            first=max(first,(s-limit_blocks+1)//2)
+        result.append({(i,s-i):(1 if i==s-i else 2) for i in range(first,s//2+1)})
     return result
 
+#sum_freqs+=freq1*freq2*mul in a single pass if numba or numexpr are available, otherwise using tmp as scratch buffer
+if njit is not None:
+    @njit(parallel=True,fastmath=True,cache=True)
+    def accumulate_pair(sum_freqs,freq1,freq2,mul,tmp):
+        for i in prange(sum_freqs.size):
+            sum_freqs[i]+=freq1[i]*freq2[i]*mul
+
+    #single threaded version for the -j worker processes (numba<0.49 cannot limit the threads of the parallel kernel)
+    @njit(fastmath=True,cache=True)
+    def accumulate_pair_serial(sum_freqs,freq1,freq2,mul,tmp):
+        for i in range(sum_freqs.size):
+            sum_freqs[i]+=freq1[i]*freq2[i]*mul
+elif ne is not None:
+    def accumulate_pair(sum_freqs,freq1,freq2,mul,tmp):
+        #numexpr computes complex numbers in double precision, so the result is cast back to complex64
+        ne.evaluate("sum_freqs+freq1*freq2*mul",out=sum_freqs,casting="same_kind")
+else:
+    def accumulate_pair(sum_freqs,freq1,freq2,mul,tmp):
+        np.multiply(freq1,freq2,out=tmp)
+        tmp*=mul
+        sum_freqs+=tmp
+if njit is None:
+    accumulate_pair_serial=accumulate_pair
+
+#sum_freqs+=freq1*freq2*mul on the GPU
+if cp is not None:
+    gpu_accumulate_pair=cp.ElementwiseKernel("T freq1, T freq2, float32 mul","T sum_freqs","sum_freqs+=freq1*freq2*mul","gpu_accumulate_pair")
+
+#the fade in/out ramps for each ramp size (only a few sizes are used)
+ramp_cache={}
+
 def ramp_window(smp,ramp_size):
-    smp[:ramp_size]*=np.linspace(0.0,1.0,ramp_size)
-    smp[-ramp_size:]*=np.linspace(1.0,0.0,ramp_size)
+    ramps=ramp_cache.get(ramp_size)
+    if ramps is None:
+        ramp_up=np.float32(np.linspace(0.0,1.0,ramp_size))
+        ramps=(ramp_up,ramp_up[::-1].copy())
+        ramp_cache[ramp_size]=ramps
+    smp[:ramp_size]*=ramps[0]
+    smp[-ramp_size:]*=ramps[1]
+
+class Object:
+    pass
+
+#state of the block mixing (each worker process has its own copy)
+mix_state=None
+
+def init_mix_state(state):
+    global mix_state
+    mix_state=state
+    if state.quantize_temp:
+        state.fft_store=np.memmap(state.fft_store_filename,dtype=np.float16,mode="r",shape=(state.n_blocks,state.nchannels,state.fft_size*2))
+        state.quant_buf1=np.empty(state.fft_size*2,dtype=np.float32)
+        state.quant_buf2=np.empty_like(state.quant_buf1)
+    else:
+        state.fft_store=np.memmap(state.fft_store_filename,dtype=np.complex64,mode="r",shape=(state.n_blocks,state.nchannels,state.fft_size))
+    state.sum_freqs=np.empty(state.fft_size,dtype=np.complex64)
+    state.tmp_freqs=np.empty_like(state.sum_freqs)
+    if state.gpu:
+        #keep the FFTs of all blocks in the GPU memory, so they are transferred only once
+        print "Uploading the FFT blocks to the GPU"
+        state.gpu_freqs=cp.empty((state.n_blocks,state.nchannels,state.fft_size),dtype=cp.complex64)
+        for block_k in range(state.n_blocks):
+            freqs=np.array(state.fft_store[block_k])
+            if state.quantize_temp:
+                freqs=freqs.astype(np.float32).view(np.complex64)*state.fft_scales[block_k][:,np.newaxis]
+            state.gpu_freqs[block_k]=cp.asarray(freqs)
+            del freqs
+        state.gpu_sum_freqs=cp.empty(state.fft_size,dtype=cp.complex64)
+        if state.envelopes is not None:
+            state.gpu_envelopes=cp.asarray(state.envelopes)
+
+#initialize a worker process; the workers share the cores, so each of them uses one thread
+def init_mix_worker(state):
+    global accumulate_pair
+    if state.fft_backend=="pyfftw":
+        use_pyfftw(1)
+    accumulate_pair=accumulate_pair_serial
+    if ne is not None:
+        ne.set_num_threads(1)
+    init_mix_state(state)
+
+def free_mix_state():
+    global mix_state
+    mix_state=None
+
+#mix the block pairs of the output block k and save it; returns the maximum amplitude of the output block
+def mix_block(k_and_block_mix):
+    (k,block_mix)=k_and_block_mix
+    st=mix_state
+    max_smp=np.float32(0.0)
+    multichannel_smps=np.empty((st.output_block_size_samples,st.nchannels),dtype=np.float32)
+    for nchannel in range(st.nchannels): 
+        if st.gpu:
+            st.gpu_sum_freqs.fill(0)
+            for ((b1_k,b2_k),mul) in block_mix.iteritems():
+                gpu_accumulate_pair(st.gpu_freqs[b1_k,nchannel],st.gpu_freqs[b2_k,nchannel],np.float32(mul),st.gpu_sum_freqs)
+            if st.envelopes is not None:
+                st.gpu_sum_freqs/=st.gpu_envelopes[nchannel]
+            smp=cp.fft.irfft(st.gpu_sum_freqs,n=st.output_block_size_samples).get()
+        else:
+            st.sum_freqs.fill(0)
+            for ((b1_k,b2_k),mul) in block_mix.iteritems():
+                freq1=st.fft_store[b1_k,nchannel]
+                freq2=st.fft_store[b2_k,nchannel]
+                mul=np.float32(mul)
+                if st.quantize_temp:
+                    freq1=dequantize_freqs(freq1,st.quant_buf1)
+                    freq2=dequantize_freqs(freq2,st.quant_buf2)
+                    mul*=st.fft_scales[b1_k,nchannel]*st.fft_scales[b2_k,nchannel]
+                accumulate_pair(st.sum_freqs,freq1,freq2,mul,st.tmp_freqs)
+            if st.envelopes is not None:
+                st.sum_freqs/=st.envelopes[nchannel]
+            smp=irfft(st.sum_freqs,st.output_block_size_samples)
+        if st.extra_output_samples>0:
+            extra=st.extra_output_samples/2
+            smp=np.roll(smp,extra)
+            ramp_window(smp,extra)
+            #debug_write_wav(os.path.join("tmp/out_%d_%04d.wav" % (nchannel,k)),sample_rate,smp) 
+        max_current_smp=max(np.amax(smp),-np.amin(smp))
+        max_smp=max(max_current_smp,max_smp)
+        multichannel_smps[:,nchannel]=smp
+        del smp
+    np.save(get_tmpsmp_filename(st.tmpdir,k),multichannel_smps)
+    return max_smp
 
 #keep envelope modes: 0 - don't keep envelope, 1 - don't keep envelope but align the sound, 2 - keep envelope
 def process_audiofile(input_filename,output_filename,options,keep_envelope_mode):
@@ -88,17 +257,11 @@ def process_audiofile(input_filename,output_filename,options,keep_envelope_mode)
         tmpdir=tempfile.mkdtemp("2xautoconvolution")
     print "Using temporary directory:", tmpdir
    
-    cmdline=["avconv", "-y", "-v","quiet", "-i",input_filename]
+    (sample_rate,nchannels)=get_audio_info(input_filename)
     if options.sample_rate>0:
-        cmdline+=["-ar",str(options.sample_rate)]
-    tmp_wav_filename=os.path.join(tmpdir,"tmp_input.wav")
-    cmdline.append(tmp_wav_filename)
-    subprocess.call(cmdline)
+        sample_rate=options.sample_rate
 
     envelopes=None
-    sample_rate=0
-    with contextlib.closing(wave.open(tmp_wav_filename,'rb')) as f:
-        sample_rate=f.getframerate()
     input_block_size_samples=int(optimize_fft_size(options.blocksize_seconds*sample_rate))
     print "Input block size (samples):",input_block_size_samples
     input_ramp_size=0
@@ -120,66 +283,76 @@ def process_audiofile(input_filename,output_filename,options,keep_envelope_mode)
     
     extra_output_samples=output_block_size_samples-input_block_size_samples*2
 
-    nchannels=0
-
     fft_size=output_block_size_samples/2+1
 
-    #read 16 bit wave files
-    with contextlib.closing(wave.open(tmp_wav_filename,'rb')) as f:
-        nsamples=f.getnframes()
-        nchannels=f.getnchannels()
-
+    #decode the input to 16 bit samples and read them directly from the avconv output
+    cmdline=["avconv", "-v","quiet", "-i",input_filename, "-f","s16le", "-ar",str(sample_rate), "-ac",str(nchannels), "pipe:1"]
+    proc=subprocess.Popen(cmdline,stdout=subprocess.PIPE,bufsize=10**7)
+    input_block_size_bytes=input_block_size_samples*nchannels*2
+    #the FFTs of all blocks are appended to a single file, which is memory-mapped for mixing
+    fft_store_filename=os.path.join(tmpdir,"tmpfft.bin")
+    with contextlib.closing(proc.stdout) as f, open(fft_store_filename,"wb") as fft_file:
         if envelopes is not None:
-            for nchannel in range(nchannels):
-                envelopes.append(np.zeros(fft_size,dtype=np.float32))
-
-        
-        n_blocks=nsamples//input_block_size_samples+1
-
-        #force adding extra zero block to flush out all the samples
-        n_blocks+=1
-        print "Using %d blocks" % n_blocks
+            envelopes=np.zeros((nchannels,fft_size),dtype=np.float32)
 
         #compute DC noise removal (removal of anything below 20Hz)
-        b20hz, a20hz = signal.butter(3,20.0/(float(sample_rate)/2.0),btype="highpass")
-        
-        zi20=[]
-        for nchannel in range(nchannels):
-            zi20.append(signal.lfilter_zi(b20hz, a20hz))
+        sos20hz=signal.butter(3,20.0/(float(sample_rate)/2.0),btype="highpass",output="sos")
+        zi20=None
 
 
-        #analyse audio and make frequency blocks
-        for block_k in range(n_blocks):
-            print "Doing FFT for block %d/%d  \r" % (block_k+1,n_blocks),
+        #analyse audio and make frequency blocks until the end of the input, plus an extra zero block to flush out all the samples
+        n_blocks=0
+        fft_scales=[]
+        input_ended=False
+        while True:
+            print "Doing FFT for block %d  \r" % (n_blocks+1),
             sys.stdout.flush()
-            inbuf=f.readframes(input_block_size_samples)
+            inbuf=""
+            if not input_ended:
+                inbuf=f.read(input_block_size_bytes)
             freq_block=[]
-            for nchannel in range(nchannels):
-                smp=np.fromstring(inbuf,dtype=np.int16)[nchannel::nchannels]
-
-                smp=smp*(1.0/32768)
-                smp, zi20[nchannel] = signal.lfilter(b20hz, a20hz, smp, zi=zi20[nchannel])
-                smp=np.float32(smp)
-                
-                if 0<input_ramp_size*2<len(smp):
-                    ramp_window(smp,input_ramp_size)
-                
-                smp=np.concatenate((smp,np.zeros(output_block_size_samples-len(smp),dtype=np.float32)))
-                in_freqs=np.complex64(np.fft.rfft(smp))
-                tmp_filename=get_tmpfft_filename(tmpdir,block_k,nchannel)
-
-                if envelopes is not None:
-                    envelopes[nchannel]+=np.abs(in_freqs)
-                np.save(tmp_filename,in_freqs)
-
-                del in_freqs
-                del smp
-
-                cleanup_memory()
+            frames=np.frombuffer(inbuf,dtype=np.int16).reshape(-1,nchannels).astype(np.float32)
+            frames*=np.float32(1.0/32768)
+            if len(frames)>0:
+                #filter all channels at once; the filter state is initialized from the first frame
+                if zi20 is None:
+                    zi20=signal.sosfilt_zi(sos20hz)[:,:,np.newaxis]*frames[0]
+                frames,zi20=signal.sosfilt(sos20hz,frames,axis=0,zi=zi20)
+            #one row for each channel, zero padded to the output block size
+            smp=np.zeros((nchannels,output_block_size_samples),dtype=np.float32)
+            smp[:,:len(frames)]=frames.T
+            if 0<input_ramp_size*2<len(frames):
+                for nchannel in range(nchannels):
+                    ramp_window(smp[nchannel,:len(frames)],input_ramp_size)
+
+            in_freqs=rfft(smp)
+            if envelopes is not None:
+                envelopes+=np.abs(in_freqs)
+            if options.quantize_temp:
+                #store as half precision, normalized by the maximum amplitude of each channel
+                scales=np.abs(in_freqs).max(axis=-1)+np.float32(1e-9)
+                in_freqs/=scales[:,np.newaxis]
+                in_freqs=in_freqs.view(np.float32).astype(np.float16)
+                fft_scales.append(scales)
+            in_freqs.tofile(fft_file)
+            n_blocks+=1
+
+            del in_freqs
+            del smp
+            del frames
+            if input_ended:
+                break
+            input_ended=len(inbuf)<input_block_size_bytes
             del inbuf
         cleanup_memory()
+    if proc.wait()!=0:
+        print
+        print "Error: Could not decode input file:",input_filename
+        sys.exit(1)
 
     print
+    print "Using %d blocks" % n_blocks
+    fft_scales=np.array(fft_scales)
         
     
     #smooth envelopes
@@ -190,46 +363,42 @@ def process_audiofile(input_filename,output_filename,options,keep_envelope_mode)
             envelopes[nchannel]=ndimage.filters.maximum_filter1d(envelopes[nchannel],size=max(int(one_hz_size_output+0.5),2))+1e-9
     
     #get the freq blocks and combine them, saving each output chunk
-    block_mixes=get_block_mixes(n_blocks)
+    block_mixes=get_block_mixes(n_blocks,options.limit_blocks)
    
+    state=Object()
+    state.tmpdir=tmpdir
+    state.fft_store_filename=fft_store_filename
+    state.n_blocks=n_blocks
+    state.nchannels=nchannels
+    state.fft_size=fft_size
+    state.output_block_size_samples=output_block_size_samples
+    state.extra_output_samples=extra_output_samples
+    state.quantize_temp=options.quantize_temp
+    state.fft_scales=fft_scales
+    state.envelopes=envelopes
+    state.gpu=options.gpu
+    state.fft_backend=options.fft_backend
+
     max_smp=np.float32(1e-6)
-    for k,block_mix in enumerate(block_mixes):
-        size_shown=len(block_mix)
-        if options.limit_blocks>0:
-            size_shown=min(size_shown,options.limit_blocks)
-        print "Mixing blocks %d/%d (size %d)       \r" % (k+1,len(block_mixes),size_shown),
+    pool=None
+    if options.jobs>1 and not options.gpu:
+        #each worker process maps the FFT file by itself, so the FFTs are shared through the OS page cache
+        pool=multiprocessing.Pool(options.jobs,init_mix_worker,(state,))
+        mixed_blocks=pool.imap(mix_block,enumerate(block_mixes))
+    else:
+        init_mix_state(state)
+        mixed_blocks=(mix_block(k_and_block_mix) for k_and_block_mix in enumerate(block_mixes))
+    for k,max_current_smp in enumerate(mixed_blocks):
+        print "Mixing blocks %d/%d (size %d)       \r" % (k+1,len(block_mixes),len(block_mixes[k])),
         sys.stdout.flush()
-        multichannel_smps=[]
-        for nchannel in range(nchannels): 
-            sum_freqs=np.zeros(output_block_size_samples/2+1,dtype=np.complex64)
-            for ((b1_k,b2_k),mul) in block_mix.iteritems():
-                if options.limit_blocks>0:
-                    if abs(b1_k-b2_k)>options.limit_blocks: 
-                        continue
-                freq1=np.load(get_tmpfft_filename(tmpdir,b1_k,nchannel))
-                freq2=np.load(get_tmpfft_filename(tmpdir,b2_k,nchannel))
-                sum_freqs+=(freq1*freq2)*mul
-                cleanup_memory()
-            if envelopes is not None:
-                sum_freqs=sum_freqs/envelopes[nchannel]
-            smp=np.float32(np.fft.irfft(sum_freqs))
-            cleanup_memory()
-            if extra_output_samples>0:
-                extra=extra_output_samples/2
-                smp=np.roll(smp,extra)
-                ramp_window(smp,extra)
-                #debug_write_wav(os.path.join("tmp/out_%d_%04d.wav" % (nchannel,k)),sample_rate,smp) 
-                cleanup_memory()
-            del sum_freqs
-            max_current_smp=max(np.amax(smp),-np.amin(smp))
-            max_smp=max(max_current_smp,max_smp)
-            multichannel_smps.append(smp)
-            del smp
-            cleanup_memory()
-        multichannel_smps=np.dstack(multichannel_smps)[0]
-        np.save(get_tmpsmp_filename(tmpdir,k),multichannel_smps)
-        del multichannel_smps
-        cleanup_memory()
+        max_smp=max(max_current_smp,max_smp)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    else:
+        free_mix_state()
+    del state
+    cleanup_memory()
 
     print
     print "Combining blocks"
@@ -239,28 +408,34 @@ def process_audiofile(input_filename,output_filename,options,keep_envelope_mode)
         f.setframerate(sample_rate)
         f.setsampwidth(2)
         
-        old_buf=[]
+        #overlap-add accumulator for the parts of the previous output blocks which are not written yet
+        #(only whole input blocks of each output block are used)
+        tail_size=(output_block_size_samples//input_block_size_samples-1)*input_block_size_samples
+        tail=np.zeros((tail_size,nchannels),dtype=np.float32)
+        #scratch buffers for the conversion to 16 bit
+        scratch_f=np.empty((input_block_size_samples,nchannels),dtype=np.float32)
+        scratch_i=np.empty((input_block_size_samples,nchannels),dtype=np.int16)
         for k in range(len(block_mixes)):
             print "Output block %d/%d \r" % (k+1,len(block_mixes)),
             sys.stdout.flush()
-            current_smps=np.float32(np.load(get_tmpsmp_filename(tmpdir,k))*(0.7/max_smp))
-            current_buf=current_smps[:input_block_size_samples]
-            result_buf=current_buf
-                 
-            old_buf=[o for o in old_buf if o.shape[0]>=input_block_size_samples]
-            for oldk,old in enumerate(old_buf):
-                result_buf+=old[:input_block_size_samples]
-                old_buf[oldk]=old[input_block_size_samples:]
-            old_buf.append(current_smps[input_block_size_samples:])
-
-            output_buf=np.int16(np.clip(result_buf,-1.0,1.0)*32767.0).flatten().tostring()
-            f.writeframes(output_buf)
+            current_smps=np.load(get_tmpsmp_filename(tmpdir,k))
+            current_smps*=np.float32(0.7/max_smp)
+            result_buf=current_smps[:input_block_size_samples]
+            result_buf+=tail[:input_block_size_samples]
+
+            tail[:-input_block_size_samples]=tail[input_block_size_samples:]
+            tail[-input_block_size_samples:]=0.0
+            tail+=current_smps[input_block_size_samples:input_block_size_samples+tail_size]
+
+            np.multiply(result_buf,32767.0,out=scratch_f)
+            np.clip(scratch_f,-32768.0,32767.0,out=scratch_f)
+            np.rint(scratch_f,out=scratch_f)
+            scratch_i[:]=scratch_f
+            f.writeframes(scratch_i.tobytes())
 
             del result_buf
             del current_smps
-            del current_buf
-            del output_buf
-            cleanup_memory()
+        del tail
 
     print
 
@@ -269,8 +444,8 @@ def process_audiofile(input_filename,output_filename,options,keep_envelope_mode)
     for fn in glob.glob(os.path.join(tmpdir,"*"+tmpextension)):
         cleanup_size+=os.path.getsize(fn)
         os.remove(fn)
-    cleanup_size+=os.path.getsize(tmp_wav_filename)
-    os.remove(tmp_wav_filename)
+    cleanup_size+=os.path.getsize(fft_store_filename)
+    os.remove(fft_store_filename)
     try:
         os.rmdir(tmpdir)
     except OSError:
@@ -281,39 +456,53 @@ def process_audiofile(input_filename,output_filename,options,keep_envelope_mode)
 
 
 
-parser = OptionParser(usage="usage: %prog [options] -o output.wav input.wav")
-parser.add_option("-o", "--output", dest="output",help="output WAV file",type="string",default="")
-parser.add_option("-k", "--keep-envelope", dest="keep_envelope", action="store_true",help="try to preserve the overall amplitude envelope",default=False)
-parser.add_option("-K", "--both-keep-envelope-modes", dest="both_keep_envelope_modes", action="store_true",help="output two files: one without keeping envelope and the other without keeping envelope",default=False)
-parser.add_option("-b", "--blocksize_seconds", dest="blocksize_seconds",help="blocksize (seconds)",type="float",default=60.0)
-parser.add_option("-l", "--limit_blocks", dest="limit_blocks",help="limit to adjacent L blocks in order to avoid mixing too distant parts of the audio file (default 0 = unlimited)",type="int",default=0)
-parser.add_option("-r", "--sample_rate", dest="sample_rate",help="convert to sample_rate",type="int",default=0)
-parser.add_option("-d", "--temp-dir", dest="temp_dir", help="directory for temporary files",type="string", default="")
-(options, args) = parser.parse_args()
-
-if len(args)!=1 or len(options.output)==0:
-    print "Error in command line parameters. Run this program with --help for help."
-    sys.exit(1)
-
-input_filename=args[0]
-print "Input file: "+input_filename
-if not os.path.isfile(input_filename):
-    print "Error: Could not open input file:",input_filename
-    sys.exit(1)
-
-if options.both_keep_envelope_modes:
-    (output_base,output_ext)=os.path.splitext(options.output)
-    print "Making two output files (with/without envelope keeping)"
-    for keep_mode in [1,2]:
-        output_file=output_base+"_k"+str(keep_mode)+output_ext
-        print "Output file: "+output_file
-        process_audiofile(input_filename,output_file,options,keep_mode)        
-
-else:
-    print "Output file: "+options.output
-    process_audiofile(input_filename,options.output,options,2 if options.keep_envelope else 0)
-print
-
-
+def main():
+    parser = OptionParser(usage="usage: %prog [options] -o output.wav input.wav")
+    parser.add_option("-o", "--output", dest="output",help="output WAV file",type="string",default="")
+    parser.add_option("-k", "--keep-envelope", dest="keep_envelope", action="store_true",help="try to preserve the overall amplitude envelope",default=False)
+    parser.add_option("-K", "--both-keep-envelope-modes", dest="both_keep_envelope_modes", action="store_true",help="output two files: one without keeping envelope and the other without keeping envelope",default=False)
+    parser.add_option("-b", "--blocksize_seconds", dest="blocksize_seconds",help="blocksize (seconds)",type="float",default=60.0)
+    parser.add_option("-l", "--limit_blocks", dest="limit_blocks",help="limit to adjacent L blocks in order to avoid mixing too distant parts of the audio file (default 0 = unlimited)",type="int",default=0)
+    parser.add_option("-r", "--sample_rate", dest="sample_rate",help="convert to sample_rate",type="int",default=0)
+    parser.add_option("-d", "--temp-dir", dest="temp_dir", help="directory for temporary files",type="string", default="")
+    parser.add_option("-j", "--jobs", dest="jobs", help="number of processes used for mixing the blocks (default 1)",type="int", default=1)
+    parser.add_option("-q", "--quantize-temp", dest="quantize_temp", action="store_true",help="store the temporary FFT blocks in half precision (half of the temporary disk space, with a small loss of precision)",default=False)
+    parser.add_option("-g", "--gpu", dest="gpu", action="store_true",help="mix the blocks on the GPU (requires cupy and enough GPU memory to hold the FFTs of all blocks)",default=False)
+    parser.add_option("-f", "--fft-backend", dest="fft_backend", help="FFT library: scipy or pyfftw (default scipy)",type="choice",choices=["scipy","pyfftw"], default="scipy")
+    (options, args) = parser.parse_args()
+
+    if len(args)!=1 or len(options.output)==0:
+        print "Error in command line parameters. Run this program with --help for help."
+        sys.exit(1)
+
+    if options.fft_backend=="pyfftw":
+        if pyfftw is None:
+            print "Error: pyfftw is not installed"
+            sys.exit(1)
+        use_pyfftw(multiprocessing.cpu_count())
+
+    if options.gpu and cp is None:
+        print "Error: cupy is not installed"
+        sys.exit(1)
+
+    input_filename=args[0]
+    print "Input file: "+input_filename
+    if not os.path.isfile(input_filename):
+        print "Error: Could not open input file:",input_filename
+        sys.exit(1)
+
+    if options.both_keep_envelope_modes:
+        (output_base,output_ext)=os.path.splitext(options.output)
+        print "Making two output files (with/without envelope keeping)"
+        for keep_mode in [1,2]:
+            output_file=output_base+"_k"+str(keep_mode)+output_ext
+            print "Output file: "+output_file
+            process_audiofile(input_filename,output_file,options,keep_mode)        
 
+    else:
+        print "Output file: "+options.output
+        process_audiofile(input_filename,options.output,options,2 if options.keep_envelope else 0)
+    print
 
+if __name__=="__main__":
+    main()